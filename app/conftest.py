@@ -0,0 +1,20 @@
+"""
+Shared pytest configuration
+"""
+import os
+
+import httpx
+import pytest_asyncio
+
+# Skip the artificial handler latency; must be set before main is imported
+os.environ.setdefault("SIMULATE_LATENCY", "0")
+
+from main import app
+
+
+@pytest_asyncio.fixture
+async def client():
+    """Async client that calls the ASGI app in-process"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
@@ -1,80 +1,169 @@
 """
 Test suite for FastAPI monitoring application
 """
-import pytest
 import asyncio
+import socket
+import time
+import urllib.request
+import pytest
 from fastapi.testclient import TestClient
-from main import app
+from prometheus_client import REGISTRY, generate_latest
+from main import app, _sample_system, SYSTEM_DISK_USAGE, SYSTEM_MEMORY_USAGE
 
-client = TestClient(app)
-
-def test_root_endpoint():
+@pytest.mark.asyncio
+async def test_root_endpoint(client):
     """Test root endpoint"""
-    response = client.get("/")
+    response = await client.get("/")
     assert response.status_code == 200
     data = response.json()
     assert "message" in data
     assert "version" in data
 
-def test_health_endpoint():
+@pytest.mark.asyncio
+async def test_health_endpoint(client):
     """Test health check endpoint"""
-    response = client.get("/health")
+    response = await client.get("/health")
     assert response.status_code == 200
     data = response.json()
     assert data["status"] == "healthy"
     assert "timestamp" in data
     assert "uptime_seconds" in data
 
-def test_metrics_endpoint():
-    """Test Prometheus metrics endpoint"""
-    response = client.get("/metrics")
-    assert response.status_code == 200
-    assert "fastapi_requests_total" in response.text
+def test_metrics_registry():
+    """Test Prometheus metrics are registered"""
+    assert "fastapi_requests_total" in generate_latest(REGISTRY).decode()
 
-def test_user_registration():
+@pytest.mark.asyncio
+async def test_user_registration(client):
     """Test user registration endpoint"""
     user_data = {
         "username": "testuser",
         "email": "test@example.com",
         "full_name": "Test User"
     }
-    response = client.post("/users/register", json=user_data)
+    response = await client.post("/users/register", json=user_data)
     assert response.status_code == 200
     data = response.json()
     assert "user_id" in data
     assert data["username"] == "testuser"
 
-def test_order_processing():
+@pytest.mark.asyncio
+async def test_order_processing(client):
     """Test order processing endpoint"""
     order_data = {
         "user_id": 1,
         "items": [{"name": "Product", "price": 29.99}],
         "total_amount": 29.99
     }
-    response = client.post("/orders", json=order_data)
+    response = await client.post("/orders", json=order_data)
     assert response.status_code == 200
     data = response.json()
     assert "order_id" in data
     assert data["total_amount"] == 29.99
+    assert data["processing_time"] < 0.5  # measured, and no simulated delay in tests
 
-def test_simulate_load():
+@pytest.mark.asyncio
+async def test_simulate_load(client):
     """Test load simulation endpoint"""
-    response = client.get("/simulate/load")
+    response = await client.get("/simulate/load")
     assert response.status_code == 200
     data = response.json()
     assert "message" in data
 
-def test_simulate_error():
+@pytest.mark.asyncio
+async def test_simulate_error(client):
     """Test error simulation endpoint"""
-    response = client.get("/simulate/error")
+    response = await client.get("/simulate/error")
     assert response.status_code == 500
 
-def test_analytics_metrics():
+@pytest.mark.asyncio
+async def test_analytics_metrics(client):
     """Test analytics endpoint"""
-    response = client.get("/analytics/metrics")
+    response = await client.get("/analytics/metrics")
     assert response.status_code == 200
     data = response.json()
     assert "active_users" in data
     assert "total_requests" in data
     assert "error_rate" in data
     assert "avg_response_time" in data
+
+@pytest.mark.asyncio
+async def test_request_metrics_use_route_template(client):
+    """Request metrics are labelled by route template and status class"""
+    await client.get("/health")
+    await client.get("/does-not-exist")
+    text = generate_latest(REGISTRY).decode()
+    assert 'endpoint="/health",method="GET",status_class="2xx"' in text
+    assert 'endpoint="unmatched",method="GET",status_class="4xx"' in text
+
+def test_system_sample():
+    """System sampler returns percentages for every gauge"""
+    _sample_system(include_disk=False)
+    sample = _sample_system(include_disk=True)
+    for key in ("cpu", "memory", "disk"):
+        assert 0.0 <= sample[key] <= 100.0
+
+@pytest.mark.asyncio
+async def test_rejects_when_overloaded(client, monkeypatch):
+    """Requests beyond the in-flight limit are rejected with 503"""
+    labels = {"method": "GET", "endpoint": "unmatched", "status_class": "5xx"}
+    before = REGISTRY.get_sample_value("fastapi_requests_total", labels) or 0
+    monkeypatch.setattr("main.REQUEST_SEM", asyncio.Semaphore(0))
+    response = await client.get("/")
+    assert response.status_code == 503
+    assert response.json() == {"detail": "overloaded"}
+    assert REGISTRY.get_sample_value("fastapi_requests_total", labels) == before + 1
+
+@pytest.mark.asyncio
+async def test_order_rejects_untyped_items(client):
+    """Order items must carry a name and price"""
+    order_data = {"user_id": 1, "items": [{}], "total_amount": 0}
+    response = await client.post("/orders", json=order_data)
+    assert response.status_code == 422
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_lifespan_serves_metrics(monkeypatch):
+    """Startup serves metrics on METRICS_PORT and shutdown releases it"""
+    port = _free_port()
+    monkeypatch.setattr("main.METRICS_PORT", port)
+    with TestClient(app):
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+        assert "fastapi_requests_total" in body
+    with socket.socket() as sock:
+        # Reuse past the scrape connection's TIME_WAIT; fails if still listening
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("0.0.0.0", port))
+        sock.listen()
+
+def test_lifespan_survives_taken_metrics_port(monkeypatch):
+    """A taken metrics port is logged, not fatal to the API"""
+    with socket.socket() as sock:
+        sock.bind(("0.0.0.0", 0))
+        sock.listen()
+        monkeypatch.setattr("main.METRICS_PORT", sock.getsockname()[1])
+        with TestClient(app) as client:
+            assert client.get("/health").status_code == 200
+
+def test_lifespan_restarts_collector(monkeypatch):
+    """Each startup runs a collector that fills the gauges straight away"""
+    monkeypatch.setattr("main.METRICS_PORT", _free_port())
+    for _ in range(2):
+        SYSTEM_MEMORY_USAGE.set(0)
+        SYSTEM_DISK_USAGE.set(0)
+        with TestClient(app):
+            deadline = time.monotonic() + 2
+            while REGISTRY.get_sample_value("system_disk_usage_percent") == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert REGISTRY.get_sample_value("system_memory_usage_percent") > 0
+            assert REGISTRY.get_sample_value("system_disk_usage_percent") > 0
+
+@pytest.mark.asyncio
+async def test_health_bypasses_overload(client, monkeypatch):
+    """Health checks are answered even when requests are being shed"""
+    monkeypatch.setattr("main.REQUEST_SEM", asyncio.Semaphore(0))
+    response = await client.get("/health")
+    assert response.status_code == 200